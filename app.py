@@ -1,24 +1,86 @@
+import os
+import secrets
 import sqlite3
+import threading
 from contextlib import asynccontextmanager
 from typing import List, Annotated
 
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Header, Query
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
 
-from db import get_db, create_table, create_subscription, get_subscription_by_id, update_subscription, \
-    get_all_subscriptions
+from db import get_db, get_read_db, create_table, create_subscription, get_subscription_by_id, update_subscription, \
+    get_all_subscriptions, enable_wal, open_read_source, open_sharded_db
+from profiling import CapturedRoute, SlowRequestLog, SlowRequestMiddleware, sample_profile
+from ratelimit import WriteAdmissionMiddleware
+
+
+# Number of SQLite files subscriptions are hash-partitioned across, 1 for the single subscriptions.db
+shard_count = int(os.environ.get("SHARD_COUNT", "1"))
 
 
 # Create the table on startup using FastAPI lifecycle event
 @asynccontextmanager
 async def lifespan(app: FastAPI): # pragma: no cover
+    if shard_count > 1:
+        # Hash-partition subscriptions across subscriptions-<n>.db files, list routes fan out read-only to every shard
+        if os.environ.get("READ_MODE", "pool") != "pool":
+            raise ValueError("Only READ_MODE=pool is supported with SHARD_COUNT > 1")
+        sharded_db = open_sharded_db([f"subscriptions-{shard}.db" for shard in range(shard_count)],
+                                     unsharded_db_name="subscriptions.db")
+        sharded_db.fan_out(enable_wal)
+        create_table(sharded_db)
+        yield
+        sharded_db.close()
+        return
+
     conn = sqlite3.connect("subscriptions.db")
+    enable_wal(conn)
     create_table(conn)
     conn.close()
+    # List and reporting routes read from read-only connections (READ_MODE=pool, READ_POOL_SIZE at once)
+    # or an in-memory replica refreshed in the background (READ_MODE=replica, serving one read at a time)
+    read_source = open_read_source(
+        "subscriptions.db",
+        mode=os.environ.get("READ_MODE", "pool"),
+        pool_size=int(os.environ.get("READ_POOL_SIZE", "4")),
+        max_staleness=float(os.environ.get("READ_MAX_STALENESS", "1.0"))
+    )
     yield
+    read_source.close()
 
 
 app = FastAPI(lifespan=lifespan)
+# Sync routes register their worker thread with the slow request capture
+app.router.route_class = CapturedRoute
+
+# Per-client rate limiting and admission control for write routes, configurable via environment.
+# Clients are keyed by address; behind a reverse proxy set CLIENT_IP_HEADER to the header the proxy
+# sets (e.g. X-Forwarded-For), otherwise all tenants share the proxy's address and its limits.
+# X-User-Name is not verified, so the per-user limit only applies to clients that send it.
+app.add_middleware(
+    WriteAdmissionMiddleware,
+    rate=float(os.environ.get("WRITE_RATE_LIMIT", "20")),
+    burst=int(os.environ.get("WRITE_RATE_BURST", "50")),
+    address_rate=float(os.environ.get("WRITE_ADDRESS_RATE_LIMIT", "100")),
+    address_burst=int(os.environ.get("WRITE_ADDRESS_RATE_BURST", "200")),
+    # The cap on running writes is global, so by default it allows 4 writers per shard
+    max_concurrent_writes=int(os.environ.get("MAX_CONCURRENT_WRITES", str(4 * shard_count))),
+    max_queued_writes=int(os.environ.get("MAX_QUEUED_WRITES", "64")),
+    max_pending_per_client=int(os.environ.get("MAX_PENDING_WRITES_PER_CLIENT", "8")),
+    queue_timeout=float(os.environ.get("WRITE_QUEUE_TIMEOUT", "2.0")),
+    client_ip_header=os.environ.get("CLIENT_IP_HEADER")
+)
+
+# Capture of requests slower than SLOW_REQUEST_THRESHOLD seconds, off when unset
+slow_request_log = SlowRequestLog(
+    threshold=float(os.environ["SLOW_REQUEST_THRESHOLD"]) if os.environ.get("SLOW_REQUEST_THRESHOLD") else None,
+    size=int(os.environ.get("SLOW_REQUEST_LOG_SIZE", "100"))
+)
+app.add_middleware(SlowRequestMiddleware, log=slow_request_log)
+
+# Only one sampling profiler runs at a time
+profiler_lock = threading.Lock()
 
 
 # Pydantic models
@@ -44,6 +106,16 @@ class SubscriptionResponse(BaseModel):
 
 
 SessionDep = Annotated[sqlite3.Connection, Depends(get_db)]
+ReadSessionDep = Annotated[sqlite3.Connection, Depends(get_read_db)]
+
+
+# Admin routes require the X-Admin-Token header to match ADMIN_TOKEN, and are disabled when it is unset
+def require_admin(x_admin_token: Annotated[str | None, Header()] = None):
+    admin_token = os.environ.get("ADMIN_TOKEN")
+    # Compare bytes, since compare_digest rejects str with non-ASCII characters
+    if not admin_token or not x_admin_token or \
+            not secrets.compare_digest(x_admin_token.encode(), admin_token.encode()):
+        raise HTTPException(status_code=403, detail="Admin access required")
 
 
 # Route to create a subscription
@@ -146,7 +218,7 @@ def resume_subscription_route(subscription_id: int, db: SessionDep):
 
 # Route to get all subscriptions
 @app.get("/subscriptions/", response_model=List[SubscriptionResponse])
-def get_all_subscriptions_route(db: SessionDep):
+def get_all_subscriptions_route(db: ReadSessionDep):
     subscriptions = get_all_subscriptions(db)
 
     return [
@@ -163,3 +235,22 @@ def get_all_subscriptions_route(db: SessionDep):
         )
         for sub in subscriptions
     ]
+
+
+# Route to sample all busy threads for some seconds, returning folded stacks for flamegraph.pl or speedscope
+@app.get("/admin/profile", response_class=PlainTextResponse, dependencies=[Depends(require_admin)])
+def profile_route(seconds: Annotated[float, Query(gt=0, le=60)] = 10,
+                  interval: Annotated[float, Query(ge=0.001, le=1)] = 0.005):
+    if not profiler_lock.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="Profiler is already running")
+
+    try:
+        return sample_profile(seconds, interval)
+    finally:
+        profiler_lock.release()
+
+
+# Route to get the captured slow requests, oldest first
+@app.get("/admin/slow-requests", dependencies=[Depends(require_admin)])
+def slow_requests_route():
+    return slow_request_log.entries()
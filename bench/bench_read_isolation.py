@@ -0,0 +1,114 @@
+"""Benchmark of update_subscription latency under a concurrent heavy read load.
+
+Reader threads scan the whole table with get_all_subscriptions in a loop while one writer
+thread times update_subscription. Compared setups:
+
+* shared: rollback journal, readers on ordinary read/write connections (the old path)
+* pool:   WAL with readers on ReadOnlyPool connections
+* replica: WAL with readers on a SnapshotReplica refreshed every READ_MAX_STALENESS seconds
+
+Run from the repository root: ``python bench/bench_read_isolation.py``
+"""
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import (create_table, get_all_subscriptions, get_subscription_by_id,  # noqa: E402
+                update_subscription, enable_wal, ReadOnlyPool, SnapshotReplica)
+
+ROWS = 50000
+READERS = 4
+WRITES = 300
+READ_MAX_STALENESS = 0.5
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+class SharedConnections:
+    def __init__(self, db_name):
+        self.db_name = db_name
+
+    @contextmanager
+    def connection(self):
+        conn = sqlite3.connect(self.db_name)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def close(self):
+        pass
+
+
+def populate(db_name, wal):
+    conn = sqlite3.connect(db_name)
+    if wal:
+        enable_wal(conn)
+    create_table(conn)
+    conn.executemany(
+        "INSERT INTO subscriptions (user_name, plan, start_date, cancelled, paused) VALUES (?, ?, ?, 0, 0)",
+        [(f"user{i}", "basic", "2024-01-01 00:00:00") for i in range(ROWS)]
+    )
+    conn.commit()
+    conn.close()
+
+
+def run(label, wal, make_source):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = os.path.join(tmp, "subscriptions.db")
+        populate(db_name, wal)
+        source = make_source(db_name)
+        stop = threading.Event()
+        scans = [0]
+
+        def reader():
+            while not stop.is_set():
+                with source.connection() as conn:
+                    get_all_subscriptions(conn)
+                scans[0] += 1
+
+        threads = [threading.Thread(target=reader) for _ in range(READERS)]
+        for thread in threads:
+            thread.start()
+
+        conn = sqlite3.connect(db_name)
+        latencies, errors = [], 0
+        for i in range(WRITES):
+            subscription = get_subscription_by_id(conn, i % ROWS + 1)
+            subscription.change_plan("premium" if i % 2 else "pro")
+            start = time.perf_counter()
+            try:
+                update_subscription(conn, i % ROWS + 1, subscription)
+            except sqlite3.OperationalError:
+                errors += 1
+                conn.rollback()
+            latencies.append((time.perf_counter() - start) * 1000)
+        conn.close()
+
+        stop.set()
+        for thread in threads:
+            thread.join()
+        source.close()
+
+    print(f"{label:8} write p50={statistics.median(latencies):8.2f}ms  p99={percentile(latencies, 99):8.2f}ms  "
+          f"max={max(latencies):8.2f}ms  errors={errors}  scans={scans[0]}")
+
+
+def main():
+    run("shared", False, SharedConnections)
+    run("pool", True, ReadOnlyPool)
+    run("replica", True, lambda db_name: SnapshotReplica(db_name, max_staleness=READ_MAX_STALENESS))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Benchmark of write throughput against the number of shards.
+
+WRITERS threads each create and update subscriptions for their own users through the db
+functions on a ShardedDB, first with a single shard and then with more. Every commit is
+durable (WAL, synchronous=FULL), so a single file serialises all writers behind one lock
+while separate shards commit in parallel.
+
+Run from the repository root: ``python bench/bench_shard_writes.py``
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import ShardedDB, create_table, create_subscription, enable_wal, get_subscription_by_id, \
+    update_subscription  # noqa: E402
+
+WRITERS = 8
+OPERATIONS_PER_WRITER = 200
+SHARD_COUNTS = (1, 2, 4, 8)
+
+
+def run(shard_count):
+    with tempfile.TemporaryDirectory() as tmp:
+        db = ShardedDB([os.path.join(tmp, f"subscriptions-{shard}.db") for shard in range(shard_count)])
+        db.fan_out(enable_wal)
+        create_table(db)
+
+        def writer(index):
+            for i in range(OPERATIONS_PER_WRITER):
+                if i % 2 == 0:
+                    subscription_id = create_subscription(db, f"user{index}-{i}", "basic")
+                else:
+                    subscription = get_subscription_by_id(db, subscription_id)
+                    subscription.change_plan("premium")
+                    update_subscription(db, subscription_id, subscription)
+
+        threads = [threading.Thread(target=writer, args=(index,)) for index in range(WRITERS)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        db.close()
+
+    return WRITERS * OPERATIONS_PER_WRITER / elapsed
+
+
+def main():
+    print(f"{os.cpu_count()} CPUs, {WRITERS} writer threads")
+    baseline = None
+    for shard_count in SHARD_COUNTS:
+        throughput = run(shard_count)
+        baseline = baseline or throughput
+        print(f"{shard_count} shard(s): {throughput:8.0f} writes/s  ({throughput / baseline:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
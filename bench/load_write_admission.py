@@ -0,0 +1,106 @@
+"""Load test for write admission control.
+
+A noisy tenant floods ``/plan`` updates on its subscription while a quiet tenant changes its own
+plan one write at a time, pausing QUIET_INTERVAL seconds between them, against a file-backed
+SQLite database. The quiet tenant runs as a closed loop since, sharing this process's event loop
+with the flood, timers for an open-loop schedule would fire in bursts whenever the loop stalls. The same
+load is run against the bare router and against the app with ``WriteAdmissionMiddleware``,
+reporting status counts per tenant and latency percentiles of each tenant's successful writes.
+
+Run from the repository root: ``python bench/load_write_admission.py``
+"""
+import asyncio
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+import httpx
+from fastapi import FastAPI
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app  # noqa: E402
+from db import create_table, create_subscription, get_db  # noqa: E402
+
+NOISY_REQUESTS = 600
+QUIET_REQUESTS = 30
+QUIET_INTERVAL = 0.02
+
+
+def percentile(values, pct):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def timed(client, method, url, headers, tenant):
+    start = time.perf_counter()
+    response = await client.request(method, url, headers=headers, json={"plan": "premium"})
+    tenant["statuses"][response.status_code] = tenant["statuses"].get(response.status_code, 0) + 1
+    if response.is_success:
+        tenant["latencies"].append((time.perf_counter() - start) * 1000)
+
+
+async def run(asgi_app, label):
+    noisy_tenant = {"statuses": {}, "latencies": []}
+    quiet_tenant = {"statuses": {}, "latencies": []}
+    # Each tenant connects from its own address
+    noisy_transport = httpx.ASGITransport(app=asgi_app, client=("10.0.0.1", 123))
+    quiet_transport = httpx.ASGITransport(app=asgi_app, client=("10.0.0.2", 123))
+    async with httpx.AsyncClient(transport=noisy_transport, base_url="http://bench") as noisy_client, \
+            httpx.AsyncClient(transport=quiet_transport, base_url="http://bench") as quiet_client:
+        noisy = [
+            timed(noisy_client, "PUT", "/subscriptions/1/plan", {"X-User-Name": "noisy"}, noisy_tenant)
+            for _ in range(NOISY_REQUESTS)
+        ]
+
+        async def quiet():
+            for _ in range(QUIET_REQUESTS):
+                await timed(quiet_client, "PUT", "/subscriptions/2/plan", {"X-User-Name": "quiet"}, quiet_tenant)
+                await asyncio.sleep(QUIET_INTERVAL)
+
+        start = time.perf_counter()
+        await asyncio.gather(*noisy, quiet())
+        elapsed = time.perf_counter() - start
+
+    print(f"{label}: {elapsed:.2f}s")
+    for name, tenant in (("noisy", noisy_tenant), ("quiet", quiet_tenant)):
+        latencies = tenant["latencies"]
+        if latencies:
+            summary = (f"p50={statistics.median(latencies):8.1f}ms  p99={percentile(latencies, 99):8.1f}ms  "
+                       f"max={max(latencies):8.1f}ms")
+        else:
+            summary = "no successful writes"
+        print(f"  {name:5} statuses={dict(sorted(tenant['statuses'].items()))}  2xx {summary}")
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "subscriptions.db")
+        conn = sqlite3.connect(db_path)
+        create_table(conn)
+        create_subscription(conn, "noisy", "basic")
+        create_subscription(conn, "quiet", "basic")
+        conn.close()
+
+        def _get_db():
+            conn_ = sqlite3.connect(db_path, check_same_thread=False)
+            try:
+                yield conn_
+            finally:
+                conn_.close()
+
+        app.dependency_overrides[get_db] = _get_db
+        # Same routes and overrides without the middleware stack, giving the unprotected baseline
+        baseline = FastAPI()
+        baseline.router.routes = app.router.routes
+        asyncio.run(run(baseline, "without admission control"))
+        asyncio.run(run(app, "with admission control"))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,296 @@
+import contextvars
+import logging
+import os
+import queue
 import sqlite3
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
+from profiling import TracedConnection, capture_thread
 from subscription import Subscription
 
+logger = logging.getLogger(__name__)
+
+
+# Sharded database used by get_db and its read-only view used by get_read_db, set up on startup with open_sharded_db
+sharded_db = None
+sharded_read_db = None
+
 
 # SQLite connection dependency
 def get_db():  # pragma: no cover
+    if sharded_db is not None:
+        yield sharded_db
+        return
     db_name = "subscriptions.db"
-    conn = sqlite3.connect(db_name)
+    conn = sqlite3.connect(db_name, factory=TracedConnection)
     try:
         yield conn
     finally:
         conn.close()
 
 
+# Read-only connection source used by get_read_db, set up on startup with open_read_source
+read_source = None
+
+
+# Read-only SQLite connection dependency for list and reporting routes
+def get_read_db():  # pragma: no cover
+    if sharded_read_db is not None:
+        yield sharded_read_db
+        return
+    with read_source.connection() as conn:
+        yield conn
+
+
+# Function to switch the database to WAL so readers never block the writer
+def enable_wal(conn: sqlite3.Connection):
+    conn.execute("PRAGMA journal_mode=WAL")
+
+
+# Function to open a read-only connection that cannot write even by accident
+def connect_read_only(db_name: str):
+    conn = sqlite3.connect(f"file:{db_name}?mode=ro", uri=True, check_same_thread=False,
+                           factory=TracedConnection)
+    conn.execute("PRAGMA query_only=ON")
+    return conn
+
+
+class ReadOnlyPool:
+    """Fixed-size pool of read-only connections, each query reading its own WAL snapshot."""
+
+    def __init__(self, db_name: str, size: int = 4):
+        self._connections = queue.LifoQueue()
+        for _ in range(size):
+            self._connections.put(connect_read_only(db_name))
+
+    @contextmanager
+    def connection(self):
+        conn = self._connections.get()
+        try:
+            yield conn
+        finally:
+            self._connections.put(conn)
+
+    def close(self):
+        while not self._connections.empty():
+            self._connections.get_nowait().close()
+
+
+class SnapshotReplica:
+    """In-memory copy of the database refreshed with the backup API every max_staleness seconds.
+
+    A background thread checks ``PRAGMA data_version`` on a long-lived read-only connection and,
+    only when the database has changed, builds a new snapshot and swaps it in, so readers never
+    wait on a backup. Each refresh still copies the whole database: it briefly holds two snapshots
+    in memory, and while it runs it competes with writes for I/O and, when writes are frequent,
+    adds to their latency. Prefer the read-only pool when writes are continuous.
+
+    All readers share the one snapshot connection and SQLite runs one statement at a time on a
+    connection, so reads from the replica are serialised rather than running side by side.
+    """
+
+    def __init__(self, db_name: str, max_staleness: float = 1.0):
+        self.db_name = db_name
+        self.max_staleness = max_staleness
+        self._source = connect_read_only(db_name)
+        self._data_version = None
+        self._snapshot = None
+        self.refresh()
+        self._stop = threading.Event()
+        self._refresher = threading.Thread(target=self._refresh_periodically, name="replica-refresh", daemon=True)
+        self._refresher.start()
+
+    def refresh(self):
+        """Copy the database into a new snapshot if it changed since the last refresh. Return whether it did."""
+        # data_version changes whenever another connection commits to the database
+        data_version = self._source.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return False
+        snapshot = sqlite3.connect(":memory:", check_same_thread=False, factory=TracedConnection)
+        self._source.backup(snapshot)
+        snapshot.execute("PRAGMA query_only=ON")
+        self._snapshot, self._data_version = snapshot, data_version
+        return True
+
+    def _refresh_periodically(self):
+        while not self._stop.wait(self.max_staleness):
+            try:
+                self.refresh()
+            except sqlite3.Error:
+                # Keep serving the previous snapshot and retry on the next period
+                logger.exception("Refreshing the read replica of %s failed", self.db_name)
+
+    @contextmanager
+    def connection(self):
+        # Replaced snapshots are closed by garbage collection once their last reader is done
+        yield self._snapshot
+
+    def close(self):
+        self._stop.set()
+        self._refresher.join()
+        self._snapshot.close()
+        self._source.close()
+
+
+# Function to set up the read source used by get_read_db ("pool" or "replica")
+def open_read_source(db_name: str, mode: str = "pool", pool_size: int = 4, max_staleness: float = 1.0):
+    global read_source
+    if mode == "replica":
+        read_source = SnapshotReplica(db_name, max_staleness=max_staleness)
+    elif mode == "pool":
+        read_source = ReadOnlyPool(db_name, size=pool_size)
+    else:
+        raise ValueError(f"Unknown read mode: {mode}")
+    return read_source
+
+
+class ShardedDB:
+    """Subscriptions hash-partitioned across several SQLite files, with one writer per shard.
+
+    New subscriptions go to the shard picked by hashing user_name. Ids are allocated so that
+    shard ``k`` of ``n`` only holds ids with ``(id - 1) % n == k``, keeping them globally unique
+    and letting lookups by id go straight to their shard. The db functions in this module accept
+    a ShardedDB wherever they accept a connection and route or fan out accordingly.
+
+    Both routing and id allocation depend on the number of shards, so each file records its
+    shard index and count, and check_layout refuses files created for another layout.
+    Changing the number of shards requires migrating the data into a new set of files.
+    """
+
+    def __init__(self, db_names: list[str], read_only: bool = False, executor: ThreadPoolExecutor | None = None):
+        self.db_names = db_names
+        self.read_only = read_only
+        self._write_locks = [threading.Lock() for _ in db_names]
+        self._executor = executor or ThreadPoolExecutor(max_workers=len(db_names), thread_name_prefix="shard")
+
+    @property
+    def shard_count(self):
+        return len(self.db_names)
+
+    def shard_for_id(self, subscription_id: int):
+        return (subscription_id - 1) % self.shard_count
+
+    def shard_for_user(self, user_name: str):
+        return zlib.crc32(user_name.encode()) % self.shard_count
+
+    def read_only_view(self):
+        """Return a ShardedDB over the same files whose connections are read-only, sharing this one's fan-out pool."""
+        return ShardedDB(self.db_names, read_only=True, executor=self._executor)
+
+    @contextmanager
+    def connection(self, shard: int):
+        if self.read_only:
+            conn = connect_read_only(self.db_names[shard])
+        else:
+            conn = sqlite3.connect(self.db_names[shard], check_same_thread=False, factory=TracedConnection)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def writer(self, shard: int):
+        with self._write_locks[shard], self.connection(shard) as conn:
+            yield conn
+
+    def fan_out(self, func):
+        """Call func with a connection to every shard in parallel and return the results in shard order."""
+        def run(shard, context):
+            with self.connection(shard) as conn:
+                return context.run(capture_thread(func), conn)
+
+        # Each shard gets its own copy of the caller's context so request profiling follows the fan-out
+        contexts = [contextvars.copy_context() for _ in range(self.shard_count)]
+        return list(self._executor.map(run, range(self.shard_count), contexts))
+
+    def check_layout(self):
+        """Check every shard file belongs to this layout, then record the layout in files that have none yet.
+
+        A file without a recorded layout is accepted only if all its subscriptions belong to its shard.
+        Raises ValueError before recording anything if any file does not match.
+        """
+        unrecorded = []
+        for shard, db_name in enumerate(self.db_names):
+            with self.connection(shard) as conn:
+                layout = get_shard_layout(conn)
+                if layout is None:
+                    if count_misplaced_subscriptions(conn, shard, self.shard_count):
+                        raise ValueError(f"{db_name} holds subscriptions that do not belong to shard {shard} of "
+                                         f"{self.shard_count}; changing the number of shards requires a migration")
+                    unrecorded.append(shard)
+                elif layout != (shard, self.shard_count):
+                    raise ValueError(f"{db_name} was created as shard {layout[0]} of {layout[1]}, not shard {shard} of "
+                                     f"{self.shard_count}; changing the number of shards requires a migration")
+
+        for shard in unrecorded:
+            with self.writer(shard) as conn:
+                set_shard_layout(conn, shard, self.shard_count)
+
+    def close(self):
+        self._executor.shutdown()
+
+
+# Function to check whether a table exists
+def _table_exists(conn: sqlite3.Connection, name: str):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,)).fetchone() is not None
+
+
+# Function to read the (shard, shard_count) recorded in a shard file, or None if there is none yet
+def get_shard_layout(conn: sqlite3.Connection):
+    if not _table_exists(conn, "shard_meta"):
+        return None
+    layout = conn.execute("SELECT shard, shard_count FROM shard_meta").fetchone()
+    return tuple(layout) if layout else None
+
+
+# Function to record the shard index and count in a shard file
+def set_shard_layout(conn: sqlite3.Connection, shard: int, shard_count: int):
+    conn.execute("CREATE TABLE IF NOT EXISTS shard_meta (shard INTEGER NOT NULL, shard_count INTEGER NOT NULL)")
+    conn.execute("INSERT INTO shard_meta (shard, shard_count) VALUES (?, ?)", (shard, shard_count))
+    conn.commit()
+
+
+# Function to count subscriptions whose id does not route to the given shard
+def count_misplaced_subscriptions(conn: sqlite3.Connection, shard: int, shard_count: int):
+    if not _table_exists(conn, "subscriptions"):
+        return 0
+    return conn.execute("SELECT COUNT(*) FROM subscriptions WHERE (id - 1) % ? != ?",
+                        (shard_count, shard)).fetchone()[0]
+
+
+# Function to set up the sharded database used by get_db and get_read_db.
+# Refuses to start if unsharded_db_name still holds subscriptions or a shard file belongs to another layout.
+def open_sharded_db(db_names: list[str], unsharded_db_name: str | None = None):
+    global sharded_db, sharded_read_db
+    if unsharded_db_name is not None and os.path.exists(unsharded_db_name):
+        conn = sqlite3.connect(unsharded_db_name)
+        try:
+            has_subscriptions = _table_exists(conn, "subscriptions") and \
+                conn.execute("SELECT 1 FROM subscriptions LIMIT 1").fetchone() is not None
+        finally:
+            conn.close()
+        if has_subscriptions:
+            raise ValueError(f"{unsharded_db_name} holds subscriptions; migrate them into the shards before "
+                             f"enabling sharding")
+
+    db = ShardedDB(db_names)
+    try:
+        db.check_layout()
+    except ValueError:
+        db.close()
+        raise
+    sharded_db, sharded_read_db = db, db.read_only_view()
+    return sharded_db
+
+
 # Function to create the subscriptions table
 def create_table(conn: sqlite3.Connection):
+    if isinstance(conn, ShardedDB):
+        conn.fan_out(create_table)
+        return
     cursor = conn.cursor()
     cursor.execute(
         '''
@@ -36,6 +312,10 @@ def create_table(conn: sqlite3.Connection):
 # Function to insert a new subscription
 def create_subscription(db: sqlite3.Connection, user_name: str, plan: str):
     sub = Subscription(user_name=user_name, plan=plan)
+    if isinstance(db, ShardedDB):
+        shard = db.shard_for_user(user_name)
+        with db.writer(shard) as conn:
+            return _create_sharded_subscription(conn, sub, shard + 1, db.shard_count)
     cursor = db.cursor()
     cursor.execute('''INSERT INTO subscriptions (user_name, plan, start_date, end_date, cancelled, paused, paused_at, resumed_at)
                       VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
@@ -46,8 +326,22 @@ def create_subscription(db: sqlite3.Connection, user_name: str, plan: str):
     return subscription_id
 
 
+# Function to insert a subscription into a shard, taking the next id in the shard's sequence first_id, first_id + stride, ...
+def _create_sharded_subscription(conn: sqlite3.Connection, sub: Subscription, first_id: int, stride: int):
+    cursor = conn.cursor()
+    cursor.execute('''INSERT INTO subscriptions (id, user_name, plan, start_date, end_date, cancelled, paused, paused_at, resumed_at)
+                      VALUES ((SELECT COALESCE(MAX(id), ?) + ? FROM subscriptions), ?, ?, ?, ?, ?, ?, ?, ?)''',
+                   (first_id - stride, stride, sub.user_name, sub.plan, sub.start_date, sub.end_date, sub.cancelled,
+                    sub.paused, sub.paused_at, sub.resumed_at))
+    conn.commit()
+    return cursor.lastrowid
+
+
 # Function to fetch a subscription by ID and return a Subscription object
 def get_subscription_by_id(db: sqlite3.Connection, subscription_id: int):
+    if isinstance(db, ShardedDB):
+        with db.connection(db.shard_for_id(subscription_id)) as conn:
+            return get_subscription_by_id(conn, subscription_id)
     cursor = db.cursor()
     subscription = cursor.execute("SELECT * FROM subscriptions WHERE id=?", (subscription_id,)).fetchone()
 
@@ -67,6 +361,10 @@ def get_subscription_by_id(db: sqlite3.Connection, subscription_id: int):
 
 # Function to update a subscription after changes
 def update_subscription(db: sqlite3.Connection, subscription_id: int, subscription: Subscription):
+    if isinstance(db, ShardedDB):
+        with db.writer(db.shard_for_id(subscription_id)) as conn:
+            update_subscription(conn, subscription_id, subscription)
+        return
     cursor = db.cursor()
     cursor.execute('''UPDATE subscriptions SET 
                       plan=?, start_date=?, end_date=?, cancelled=?, paused=?, paused_at=?, resumed_at=? 
@@ -78,6 +376,9 @@ def update_subscription(db: sqlite3.Connection, subscription_id: int, subscripti
 
 # Function to fetch all subscriptions
 def get_all_subscriptions(db: sqlite3.Connection):
+    if isinstance(db, ShardedDB):
+        subscriptions = [sub for shard in db.fan_out(get_all_subscriptions) for sub in shard]
+        return sorted(subscriptions, key=lambda sub: sub[0])
     cursor = db.cursor()
     subscriptions = cursor.execute("SELECT * FROM subscriptions").fetchall()
     return subscriptions
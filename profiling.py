@@ -0,0 +1,267 @@
+import asyncio
+import contextvars
+import functools
+import inspect
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+from fastapi.routing import APIRoute
+
+# Frames from these files mean the thread is waiting for work rather than doing any
+IDLE_FILES = ("threading.py", "queue.py", "selectors.py")
+
+# Statements recorded per request beyond this are only counted
+MAX_SQL_PER_REQUEST = 100
+
+# Capture for the request being served, set by SlowRequestMiddleware and copied into worker threads
+current_capture = contextvars.ContextVar("current_capture", default=None)
+
+
+class RequestCapture:
+    """SQL statements, timings and sampled stacks collected while serving one request."""
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.status_code = None
+        self.start = time.perf_counter()
+        self.duration = None
+        self.threads = set()
+        self.sql = []
+        self.sql_dropped = 0
+        self.stacks = Counter()
+
+    def record_sql(self, statement: str, duration: float):
+        if len(self.sql) >= MAX_SQL_PER_REQUEST:
+            self.sql_dropped += 1
+            return None
+        entry = [" ".join(statement.split()), duration]
+        self.sql.append(entry)
+        return entry
+
+    def as_dict(self):
+        return {
+            "method": self.method,
+            "path": self.path,
+            "status_code": self.status_code,
+            "duration_ms": round(self.duration * 1000, 3),
+            "sql": [{"statement": statement, "duration_ms": round(duration * 1000, 3)}
+                    for statement, duration in self.sql],
+            "sql_dropped": self.sql_dropped,
+            "stacks": format_folded(self.stacks)
+        }
+
+
+# Function to wrap func so the thread running it is sampled for the current request capture while it runs
+def capture_thread(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        capture = current_capture.get()
+        if capture is None:
+            return func(*args, **kwargs)
+        thread_id = threading.get_ident()
+        capture.threads.add(thread_id)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            capture.threads.discard(thread_id)
+
+    return wrapper
+
+
+class CapturedRoute(APIRoute):
+    """Route whose sync endpoint registers its worker thread with the current request capture.
+
+    Work done on the shared event loop thread, such as parsing the request body, is not sampled.
+    """
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        if not inspect.iscoroutinefunction(endpoint):
+            endpoint = capture_thread(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+
+class TracedCursor(sqlite3.Cursor):
+    """Cursor that times statements, including fetching their rows, into the current request capture."""
+
+    _entry = None
+
+    def execute(self, sql, parameters=()):
+        capture = current_capture.get()
+        if capture is None:
+            self._entry = None
+            return super().execute(sql, parameters)
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._entry = capture.record_sql(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        capture = current_capture.get()
+        if capture is None:
+            self._entry = None
+            return super().executemany(sql, seq_of_parameters)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._entry = capture.record_sql(sql, time.perf_counter() - start)
+
+    def fetchone(self):
+        if self._entry is None:
+            return super().fetchone()
+        start = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            self._entry[1] += time.perf_counter() - start
+
+    def fetchmany(self, size=None):
+        if self._entry is None:
+            return super().fetchmany(self.arraysize if size is None else size)
+        start = time.perf_counter()
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            self._entry[1] += time.perf_counter() - start
+
+    def fetchall(self):
+        if self._entry is None:
+            return super().fetchall()
+        start = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            self._entry[1] += time.perf_counter() - start
+
+
+class TracedConnection(sqlite3.Connection):
+    """Connection factory whose cursors report to the current request capture, if any."""
+
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    # Connection.execute and executemany build a plain cursor in C, so route them through cursor()
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+# Function to fold a thread's stack into a "file:function;file:function" line, root first
+def fold_stack(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    names.reverse()
+    return ";".join(names)
+
+
+# Function to check whether a thread is just waiting for work
+def is_idle(frame):
+    return os.path.basename(frame.f_code.co_filename) in IDLE_FILES
+
+
+# Function to format stack counts in the folded format read by flamegraph.pl and speedscope
+def format_folded(stacks: Counter):
+    return [f"{stack} {count}" for stack, count in stacks.most_common()]
+
+
+# Function to sample the stacks of all busy threads for the given number of seconds
+def sample_profile(seconds: float, interval: float = 0.005):
+    own_thread = threading.get_ident()
+    stacks = Counter()
+    deadline = time.monotonic() + seconds
+
+    while time.monotonic() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id != own_thread and not is_idle(frame):
+                stacks[fold_stack(frame)] += 1
+        time.sleep(interval)
+
+    return "\n".join(format_folded(stacks)) + "\n"
+
+
+class SlowRequestLog:
+    """Bounded ring buffer of captures for requests slower than threshold seconds.
+
+    Stacks of the threads serving a request are sampled only once it has run past the
+    threshold, by a sampler thread that exits when no such request is in flight.
+    A threshold of None turns capturing off.
+    """
+
+    def __init__(self, threshold: float | None = None, size: int = 100, interval: float = 0.005):
+        self.threshold = threshold
+        self.interval = interval
+        self._captures = deque(maxlen=size)
+        self._watched = set()
+        self._lock = threading.Lock()
+        self._sampler = None
+
+    def entries(self):
+        return list(self._captures)
+
+    def watch(self, capture: RequestCapture):
+        with self._lock:
+            self._watched.add(capture)
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample, name="slow-request-sampler", daemon=True)
+                self._sampler.start()
+
+    def finish(self, capture: RequestCapture):
+        capture.duration = time.perf_counter() - capture.start
+        with self._lock:
+            self._watched.discard(capture)
+        if capture.duration >= self.threshold:
+            self._captures.append(capture.as_dict())
+
+    def _sample(self):
+        while True:
+            with self._lock:
+                if not self._watched:
+                    self._sampler = None
+                    return
+                frames = sys._current_frames()
+                for capture in self._watched:
+                    for thread_id in tuple(capture.threads):
+                        frame = frames.get(thread_id)
+                        if frame is not None and not is_idle(frame):
+                            capture.stacks[fold_stack(frame)] += 1
+            time.sleep(self.interval)
+
+
+class SlowRequestMiddleware:
+    """ASGI middleware recording requests slower than the log's threshold into a SlowRequestLog."""
+
+    def __init__(self, app, log: SlowRequestLog):
+        self.app = app
+        self.log = log
+
+    async def __call__(self, scope, receive, send):
+        if self.log.threshold is None or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        capture = RequestCapture(scope["method"], scope["path"])
+        token = current_capture.set(capture)
+        timer = asyncio.get_running_loop().call_later(self.log.threshold, self.log.watch, capture)
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                capture.status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            timer.cancel()
+            current_capture.reset(token)
+            self.log.finish(capture)
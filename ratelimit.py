@@ -0,0 +1,167 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict
+
+from starlette.responses import JSONResponse
+
+WRITE_METHODS = frozenset({"POST", "PUT", "PATCH", "DELETE"})
+
+
+class TokenBucketLimiter:
+    """In-memory token buckets keyed by client, with O(1) updates and LRU eviction."""
+
+    def __init__(self, rate: float, burst: int, max_keys: int = 10000, clock=time.monotonic):
+        if rate <= 0:
+            raise ValueError("Rate must be positive")
+        if burst < 1:
+            raise ValueError("Burst must be at least 1")
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets = OrderedDict()
+
+    def acquire(self, key: str) -> float:
+        """Take a token for key. Return 0 if allowed, else the seconds until a token is available."""
+        now = self.clock()
+        bucket = self._buckets.get(key)
+
+        if bucket is None:
+            tokens = float(self.burst)
+            if len(self._buckets) >= self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            tokens, last = bucket
+            tokens = min(float(self.burst), tokens + (now - last) * self.rate)
+            self._buckets.move_to_end(key)
+
+        if tokens >= 1:
+            self._buckets[key] = (tokens - 1, now)
+            return 0.0
+
+        self._buckets[key] = (tokens, now)
+        return (1 - tokens) / self.rate
+
+
+class WriteAdmissionMiddleware:
+    """ASGI middleware that rate limits write requests per client and caps concurrent writers.
+
+    Clients are identified by their address, taken from ``client_ip_header`` when the app runs
+    behind a trusted reverse proxy that sets it, else from the connection. Without that header
+    every tenant behind a proxy shares the proxy's address and so one bucket.
+
+    Every write takes a token from its client's bucket, and, when the request names a user in
+    the ``X-User-Name`` header, from that user's bucket too. Nothing verifies that header and
+    the subscription routes identify subscriptions by id, so it only narrows the limit for
+    clients that choose to send it; the client bucket is the limit that holds.
+    A client over either rate gets 429.
+
+    When all writer slots are busy, requests wait in a bounded queue; once the queue is full
+    or the wait exceeds ``queue_timeout`` they get 503. Each client may have at most
+    ``max_pending_per_client`` writes running or queued, beyond which it gets 429, so one
+    client cannot fill the queue and starve the others.
+    """
+
+    def __init__(self, app, rate: float = 20.0, burst: int = 50, address_rate: float = 100.0,
+                 address_burst: int = 200, max_concurrent_writes: int = 4, max_queued_writes: int = 64,
+                 max_pending_per_client: int = 8, queue_timeout: float = 2.0, max_keys: int = 10000,
+                 client_ip_header: str | None = None):
+        if max_pending_per_client >= max_concurrent_writes + max_queued_writes:
+            raise ValueError("max_pending_per_client must be below max_concurrent_writes + max_queued_writes")
+        self.app = app
+        self.limiter = TokenBucketLimiter(rate, burst, max_keys=max_keys)
+        self.address_limiter = TokenBucketLimiter(address_rate, address_burst, max_keys=max_keys)
+        self.max_concurrent_writes = max_concurrent_writes
+        self.max_queued_writes = max_queued_writes
+        self.max_pending_per_client = max_pending_per_client
+        self.queue_timeout = queue_timeout
+        self.client_ip_header = client_ip_header.lower().encode("latin-1") if client_ip_header else None
+        self.queued = 0
+        self._pending = {}
+        self._slots = None
+        self._loop = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in WRITE_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        client = self._client_address(scope)
+        retry_after = self.address_limiter.acquire(client)
+        if not retry_after:
+            user_name = self._header(scope, b"x-user-name")
+            if user_name is not None:
+                retry_after = self.limiter.acquire(user_name)
+        if retry_after:
+            await self._reject(429, "Rate limit exceeded", retry_after, scope, receive, send)
+            return
+
+        pending = self._pending.get(client, 0)
+        if pending >= self.max_pending_per_client:
+            await self._reject(429, "Too many pending writes for this client", self.queue_timeout,
+                               scope, receive, send)
+            return
+
+        self._pending[client] = pending + 1
+        try:
+            await self._admit(scope, receive, send)
+        finally:
+            pending = self._pending.pop(client) - 1
+            if pending:
+                self._pending[client] = pending
+
+    async def _admit(self, scope, receive, send):
+        slots = self._get_slots()
+        if slots.locked():
+            if self.queued >= self.max_queued_writes:
+                await self._reject(503, "Too many pending writes", self.queue_timeout, scope, receive, send)
+                return
+            self.queued += 1
+            try:
+                await asyncio.wait_for(slots.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                await self._reject(503, "Too many pending writes", self.queue_timeout, scope, receive, send)
+                return
+            finally:
+                self.queued -= 1
+        else:
+            await slots.acquire()
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            slots.release()
+
+    def _get_slots(self):
+        # The semaphore is bound to the event loop it is first used on, so recreate it if the loop changes
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._slots = asyncio.Semaphore(self.max_concurrent_writes)
+            self._loop = loop
+        return self._slots
+
+    def _client_address(self, scope) -> str:
+        if self.client_ip_header is not None:
+            forwarded = self._header(scope, self.client_ip_header)
+            if forwarded:
+                # The trusted proxy appends the address it saw, so take the last entry
+                return forwarded.rsplit(",", 1)[-1].strip()
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    @staticmethod
+    def _header(scope, name: bytes):
+        for header, value in scope["headers"]:
+            if header == name:
+                return value.decode("latin-1")
+        return None
+
+    @staticmethod
+    async def _reject(status_code: int, detail: str, retry_after: float, scope, receive, send):
+        response = JSONResponse(
+            {"detail": detail},
+            status_code=status_code,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+        await response(scope, receive, send)
@@ -4,7 +4,7 @@ import pytest
 from fastapi.testclient import TestClient
 
 from app import app  # Assuming your FastAPI app is in a file called `app.py`
-from db import create_table, get_db
+from db import create_table, get_db, get_read_db
 
 client = TestClient(app)
 
@@ -28,6 +28,7 @@ def override_get_db(db_connection):
 
     # Override the dependency
     app.dependency_overrides[get_db] = _override_get_db
+    app.dependency_overrides[get_read_db] = _override_get_db
 
 
 # Test creating a subscription
@@ -150,3 +151,46 @@ def test_pause_non_existent_subscription(override_get_db):
     response = client.post("/subscriptions/9999/pause")
     assert response.status_code == 404
     assert response.json()["detail"] == "Subscription not found"
+
+
+# Test admin routes are rejected without the admin token
+def test_admin_routes_require_token(monkeypatch):
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+
+    assert client.get("/admin/slow-requests").status_code == 403
+    assert client.get("/admin/slow-requests", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    assert client.get("/admin/profile?seconds=0.01").status_code == 403
+
+
+# Test a non-ASCII admin token is rejected rather than failing the request
+def test_admin_routes_non_ascii_token(monkeypatch):
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+
+    response = client.get("/admin/slow-requests", headers={"X-Admin-Token": b"caf\xe9"})
+    assert response.status_code == 403
+
+
+# Test admin routes are disabled when no admin token is configured
+def test_admin_routes_disabled(monkeypatch):
+    monkeypatch.delenv("ADMIN_TOKEN", raising=False)
+
+    response = client.get("/admin/slow-requests", headers={"X-Admin-Token": ""})
+    assert response.status_code == 403
+
+
+# Test running the sampling profiler through the admin route
+def test_admin_profile(monkeypatch):
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+
+    response = client.get("/admin/profile?seconds=0.05", headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+
+
+# Test getting the slow request log through the admin route
+def test_admin_slow_requests(monkeypatch):
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+
+    response = client.get("/admin/slow-requests", headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 200
+    assert response.json() == []
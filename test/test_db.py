@@ -1,7 +1,12 @@
 import pytest
 import sqlite3
-from db import create_table, create_subscription, get_subscription_by_id, update_subscription
+
+import db
+from db import create_table, create_subscription, get_subscription_by_id, update_subscription, \
+    get_all_subscriptions, enable_wal, ReadOnlyPool, SnapshotReplica, ShardedDB, open_read_source, open_sharded_db, \
+    get_shard_layout
 from subscription import Subscription
+import time
 from datetime import datetime
 
 
@@ -15,6 +20,26 @@ def db_connection():
     conn.close()  # Teardown: Close the connection after the test
 
 
+# Fixture to create a file-backed WAL database for read-only connections
+@pytest.fixture(scope="function")
+def db_file(tmp_path):
+    db_name = str(tmp_path / "subscriptions.db")
+    conn = sqlite3.connect(db_name)
+    enable_wal(conn)
+    create_table(conn)
+    yield db_name, conn
+    conn.close()
+
+
+# Fixture to create a sharded database across three files
+@pytest.fixture(scope="function")
+def sharded_db(tmp_path):
+    db = ShardedDB([str(tmp_path / f"subscriptions-{shard}.db") for shard in range(3)])
+    create_table(db)
+    yield db
+    db.close()
+
+
 # Test create_table function (already executed in the fixture)
 def test_create_table(db_connection):
     cursor = db_connection.cursor()
@@ -114,3 +139,166 @@ def test_update_cancelled_subscription(db_connection):
     # Verify the subscription is cancelled
     assert updated_sub[4] is not None  # end_date should be set (indicating cancellation)
     assert updated_sub[5] == 1  # cancelled should be True
+
+
+# Test the read-only pool sees committed writes and rejects writes
+def test_read_only_pool(db_file):
+    db_name, conn = db_file
+    pool = ReadOnlyPool(db_name, size=2)
+    create_subscription(conn, "Test User", "basic")
+
+    with pool.connection() as read_conn:
+        assert len(get_all_subscriptions(read_conn)) == 1
+        with pytest.raises(sqlite3.OperationalError):
+            create_subscription(read_conn, "Other User", "basic")
+
+    pool.close()
+
+
+# Test reads from the in-memory replica never refresh it themselves
+def test_snapshot_replica_read_does_not_refresh(db_file):
+    db_name, conn = db_file
+    replica = SnapshotReplica(db_name, max_staleness=60.0)
+    create_subscription(conn, "Test User", "basic")
+
+    with replica.connection() as read_conn:
+        assert get_all_subscriptions(read_conn) == []
+        with pytest.raises(sqlite3.OperationalError):
+            create_subscription(read_conn, "Other User", "basic")
+
+    replica.close()
+
+
+# Test the replica is only copied again once the database has changed
+def test_snapshot_replica_skips_unchanged_refresh(db_file):
+    db_name, conn = db_file
+    replica = SnapshotReplica(db_name, max_staleness=60.0)
+
+    assert replica.refresh() is False
+    create_subscription(conn, "Test User", "basic")
+    assert replica.refresh() is True
+    assert replica.refresh() is False
+
+    with replica.connection() as read_conn:
+        assert len(get_all_subscriptions(read_conn)) == 1
+
+    replica.close()
+
+
+# Test the in-memory replica is refreshed in the background every max_staleness seconds
+def test_snapshot_replica_periodic_refresh(db_file):
+    db_name, conn = db_file
+    replica = SnapshotReplica(db_name, max_staleness=0.01)
+    create_subscription(conn, "Test User", "basic")
+
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        with replica.connection() as read_conn:
+            if get_all_subscriptions(read_conn):
+                break
+        time.sleep(0.01)
+
+    with replica.connection() as read_conn:
+        assert len(get_all_subscriptions(read_conn)) == 1
+
+    replica.close()
+
+
+# Test open_read_source rejects unknown modes
+def test_open_read_source_unknown_mode(db_file):
+    db_name, _ = db_file
+    with pytest.raises(ValueError, match="Unknown read mode"):
+        open_read_source(db_name, mode="primary")
+
+
+# Test sharded subscriptions get globally unique ids that route back to their shard
+def test_sharded_create_subscription(sharded_db):
+    users = [f"user{i}" for i in range(20)]
+    ids = [create_subscription(sharded_db, user_name, "basic") for user_name in users]
+
+    assert len(set(ids)) == len(ids)
+    assert {sharded_db.shard_for_user(user_name) for user_name in users} == {0, 1, 2}
+    for subscription_id, user_name in zip(ids, users):
+        assert sharded_db.shard_for_id(subscription_id) == sharded_db.shard_for_user(user_name)
+        assert get_subscription_by_id(sharded_db, subscription_id).user_name == user_name
+
+
+# Test updating a subscription in a sharded database
+def test_sharded_update_subscription(sharded_db):
+    subscription_id = create_subscription(sharded_db, "Test User", "basic")
+    subscription = get_subscription_by_id(sharded_db, subscription_id)
+    subscription.change_plan("premium")
+
+    update_subscription(sharded_db, subscription_id, subscription)
+
+    assert get_subscription_by_id(sharded_db, subscription_id).plan == "premium"
+
+
+# Test listing subscriptions merges every shard in id order
+def test_sharded_get_all_subscriptions(sharded_db):
+    ids = [create_subscription(sharded_db, f"user{i}", "basic") for i in range(10)]
+
+    subscriptions = get_all_subscriptions(sharded_db)
+
+    assert [sub[0] for sub in subscriptions] == sorted(ids)
+
+
+# Fixture to keep open_sharded_db from leaking the module-level sharded database into other tests
+@pytest.fixture(scope="function")
+def shard_names(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "sharded_db", None)
+    monkeypatch.setattr(db, "sharded_read_db", None)
+    return lambda count: [str(tmp_path / f"subscriptions-{shard}.db") for shard in range(count)]
+
+
+# Test each shard file records its layout and reopening with the same layout is accepted
+def test_open_sharded_db_records_layout(shard_names):
+    sharded = open_sharded_db(shard_names(3))
+    create_table(sharded)
+    subscription_id = create_subscription(sharded, "Test User", "basic")
+    sharded.close()
+
+    sharded = open_sharded_db(shard_names(3))
+    assert sharded.fan_out(get_shard_layout) == [(0, 3), (1, 3), (2, 3)]
+    assert get_subscription_by_id(sharded, subscription_id).user_name == "Test User"
+    sharded.close()
+
+
+# Test opening shard files with a different number of shards is refused
+def test_open_sharded_db_layout_mismatch(shard_names):
+    open_sharded_db(shard_names(3)).close()
+
+    with pytest.raises(ValueError, match="created as shard 0 of 3, not shard 0 of 2"):
+        open_sharded_db(shard_names(2))
+
+
+# Test shard files without a recorded layout are refused when their ids belong to other shards
+def test_open_sharded_db_misplaced_subscriptions(shard_names):
+    names = shard_names(2)
+    conn = sqlite3.connect(names[0])
+    create_table(conn)
+    create_subscription(conn, "First User", "basic")
+    create_subscription(conn, "Second User", "basic")  # id 2 belongs to shard 1 of 2
+    conn.close()
+
+    with pytest.raises(ValueError, match="do not belong to shard 0 of 2"):
+        open_sharded_db(names)
+
+
+# Test enabling sharding is refused while the unsharded database still holds subscriptions
+def test_open_sharded_db_unsharded_subscriptions(shard_names, db_file):
+    db_name, conn = db_file
+    create_subscription(conn, "Test User", "basic")
+
+    with pytest.raises(ValueError, match="migrate them into the shards"):
+        open_sharded_db(shard_names(2), unsharded_db_name=db_name)
+
+
+# Test reads through the read-only view fan out to every shard and reject writes
+def test_sharded_read_only_view(sharded_db):
+    ids = [create_subscription(sharded_db, f"user{i}", "basic") for i in range(5)]
+    read_db = sharded_db.read_only_view()
+
+    assert [sub[0] for sub in get_all_subscriptions(read_db)] == sorted(ids)
+    with pytest.raises(sqlite3.OperationalError):
+        create_subscription(read_db, "Other User", "basic")
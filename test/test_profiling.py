@@ -0,0 +1,194 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from db import create_table, create_subscription, get_all_subscriptions
+from profiling import CapturedRoute, RequestCapture, SlowRequestLog, SlowRequestMiddleware, TracedConnection, current_capture, \
+    fold_stack, sample_profile
+
+
+# Fixture to create an in-memory database using traced connections
+@pytest.fixture(scope="function")
+def traced_connection():
+    conn = sqlite3.connect(":memory:", check_same_thread=False, factory=TracedConnection)
+    create_table(conn)
+    yield conn
+    conn.close()
+
+
+# Test statements are recorded with their timings while a capture is active
+def test_traced_connection_records_sql(traced_connection):
+    capture = RequestCapture("GET", "/subscriptions/")
+    token = current_capture.set(capture)
+    try:
+        create_subscription(traced_connection, "Test User", "basic")
+        get_all_subscriptions(traced_connection)
+    finally:
+        current_capture.reset(token)
+
+    statements = [statement for statement, _ in capture.sql]
+    assert statements[0].startswith("INSERT INTO subscriptions")
+    assert statements[1] == "SELECT * FROM subscriptions"
+    assert all(duration >= 0 for _, duration in capture.sql)
+
+
+# Test statements run through Connection.execute and executemany are recorded too
+def test_traced_connection_execute(traced_connection):
+    capture = RequestCapture("GET", "/subscriptions/")
+    token = current_capture.set(capture)
+    try:
+        assert traced_connection.execute("SELECT 1").fetchone() == (1,)
+        traced_connection.executemany("INSERT INTO subscriptions (user_name, plan, start_date, cancelled, paused) "
+                                      "VALUES (?, 'basic', '2024-01-01 00:00:00', 0, 0)", [("a",), ("b",)])
+    finally:
+        current_capture.reset(token)
+
+    statements = [statement for statement, _ in capture.sql]
+    assert statements[0] == "SELECT 1"
+    assert statements[1].startswith("INSERT INTO subscriptions")
+
+
+# Test nothing is recorded without an active capture
+def test_traced_connection_without_capture(traced_connection):
+    capture = RequestCapture("GET", "/subscriptions/")
+
+    create_subscription(traced_connection, "Test User", "basic")
+
+    assert capture.sql == []
+
+
+# Test stacks are folded root first
+def test_fold_stack():
+    def inner():
+        import sys
+        return fold_stack(sys._getframe())
+
+    stack = inner()
+    assert stack.endswith("test_profiling.py:test_fold_stack;test_profiling.py:inner")
+
+
+# Test the sampling profiler returns folded stacks of busy threads
+def test_sample_profile():
+    stop = threading.Event()
+
+    def busy():
+        while not stop.is_set():
+            sum(range(1000))
+
+    thread = threading.Thread(target=busy)
+    thread.start()
+    try:
+        output = sample_profile(0.1, interval=0.001)
+    finally:
+        stop.set()
+        thread.join()
+
+    assert "test_profiling.py:busy" in output
+    stack, count = output.splitlines()[0].rsplit(" ", 1)
+    assert int(count) > 0
+
+
+# Test slow requests are captured with their SQL and stacks, and fast ones are not
+def test_slow_request_capture(traced_connection):
+    log = SlowRequestLog(threshold=0.05, size=2, interval=0.001)
+    slow_app = FastAPI()
+    slow_app.router.route_class = CapturedRoute
+    slow_app.add_middleware(SlowRequestMiddleware, log=log)
+
+    @slow_app.get("/slow")
+    def slow():
+        get_all_subscriptions(traced_connection)
+        time.sleep(0.15)
+        return {"ok": True}
+
+    @slow_app.get("/fast")
+    def fast():
+        return {"ok": True}
+
+    client = TestClient(slow_app)
+    client.get("/fast")
+    for _ in range(3):
+        client.get("/slow")
+
+    entries = log.entries()
+    assert len(entries) == 2  # The ring buffer keeps the latest entries only
+    assert entries[0]["path"] == "/slow"
+    assert entries[0]["status_code"] == 200
+    assert entries[0]["duration_ms"] >= 50
+    assert entries[0]["sql"][0]["statement"] == "SELECT * FROM subscriptions"
+    assert any("test_profiling.py:slow" in stack for stack in entries[0]["stacks"])
+
+
+# Fixture to create an app capturing requests slower than 50ms
+@pytest.fixture(scope="function")
+def captured_app():
+    log = SlowRequestLog(threshold=0.05, interval=0.001)
+    captured_app = FastAPI()
+    captured_app.router.route_class = CapturedRoute
+    captured_app.add_middleware(SlowRequestMiddleware, log=log)
+    return captured_app, log
+
+
+# Test CPU time spent without any SQL is sampled on the worker thread running the route
+def test_slow_request_capture_cpu_bound(captured_app):
+    cpu_app, log = captured_app
+
+    @cpu_app.get("/busy")
+    def busy():
+        deadline = time.perf_counter() + 0.2
+        while time.perf_counter() < deadline:
+            sum(range(1000))
+        return {"ok": True}
+
+    TestClient(cpu_app).get("/busy")
+
+    entries = log.entries()
+    assert entries[0]["sql"] == []
+    assert any("test_profiling.py:busy" in stack for stack in entries[0]["stacks"])
+
+
+# Test stacks of a concurrent request are not counted against another request's capture
+def test_slow_request_capture_isolated(captured_app):
+    isolated_app, log = captured_app
+
+    @isolated_app.get("/busy")
+    def busy():
+        deadline = time.perf_counter() + 0.3
+        while time.perf_counter() < deadline:
+            sum(range(1000))
+        return {"ok": True}
+
+    @isolated_app.get("/sleepy")
+    def sleepy():
+        time.sleep(0.3)
+        return {"ok": True}
+
+    client = TestClient(isolated_app)
+    thread = threading.Thread(target=client.get, args=("/busy",))
+    thread.start()
+    client.get("/sleepy")
+    thread.join()
+
+    entries = {entry["path"]: entry for entry in log.entries()}
+    assert any("test_profiling.py:busy" in stack for stack in entries["/busy"]["stacks"])
+    assert not any("test_profiling.py:busy" in stack for stack in entries["/sleepy"]["stacks"])
+    assert any("test_profiling.py:sleepy" in stack for stack in entries["/sleepy"]["stacks"])
+
+
+# Test requests are not captured when the threshold is unset
+def test_slow_request_capture_off():
+    log = SlowRequestLog()
+    off_app = FastAPI()
+    off_app.add_middleware(SlowRequestMiddleware, log=log)
+
+    @off_app.get("/slow")
+    def slow():
+        assert current_capture.get() is None
+        return {"ok": True}
+
+    assert TestClient(off_app).get("/slow").status_code == 200
+    assert log.entries() == []
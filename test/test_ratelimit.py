@@ -0,0 +1,196 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from ratelimit import TokenBucketLimiter, WriteAdmissionMiddleware
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+# Fixture to create a small app protected by the middleware
+@pytest.fixture(scope="function")
+def limited_client():
+    limited_app = FastAPI()
+    limited_app.add_middleware(WriteAdmissionMiddleware, rate=1.0, burst=2, address_rate=1.0, address_burst=5)
+
+    @limited_app.post("/write")
+    def write():
+        return {"ok": True}
+
+    @limited_app.get("/read")
+    def read():
+        return {"ok": True}
+
+    return TestClient(limited_app)
+
+
+# Test the bucket allows a burst and then refills at the configured rate
+def test_token_bucket_burst_and_refill():
+    clock = FakeClock()
+    limiter = TokenBucketLimiter(rate=2.0, burst=2, clock=clock)
+
+    assert limiter.acquire("a") == 0
+    assert limiter.acquire("a") == 0
+    assert limiter.acquire("a") == pytest.approx(0.5)
+
+    clock.now = 0.5
+    assert limiter.acquire("a") == 0
+
+
+# Test buckets are independent per key
+def test_token_bucket_per_key():
+    limiter = TokenBucketLimiter(rate=1.0, burst=1, clock=FakeClock())
+
+    assert limiter.acquire("a") == 0
+    assert limiter.acquire("a") > 0
+    assert limiter.acquire("b") == 0
+
+
+# Test the least recently seen key is evicted once max_keys is reached
+def test_token_bucket_evicts_oldest_key():
+    limiter = TokenBucketLimiter(rate=1.0, burst=1, max_keys=2, clock=FakeClock())
+
+    limiter.acquire("a")
+    limiter.acquire("b")
+    limiter.acquire("c")
+
+    assert len(limiter._buckets) == 2
+    assert limiter.acquire("a") == 0  # "a" was evicted and starts with a full bucket
+
+
+# Test the limiter rejects a rate or burst that would never admit a request
+def test_token_bucket_invalid_limits():
+    with pytest.raises(ValueError, match="Rate must be positive"):
+        TokenBucketLimiter(rate=0, burst=1)
+    with pytest.raises(ValueError, match="Burst must be at least 1"):
+        TokenBucketLimiter(rate=1.0, burst=0)
+
+
+# Test a client address over its rate gets 429 with Retry-After
+def test_write_rate_limited(limited_client):
+    for _ in range(5):
+        assert limited_client.post("/write").status_code == 200
+
+    response = limited_client.post("/write")
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "1"
+    assert response.json()["detail"] == "Rate limit exceeded"
+
+
+# Test users named by the X-User-Name header get their own buckets
+def test_write_rate_limited_per_user(limited_client):
+    for _ in range(2):
+        limited_client.post("/write", headers={"X-User-Name": "noisy"})
+
+    assert limited_client.post("/write", headers={"X-User-Name": "noisy"}).status_code == 429
+    assert limited_client.post("/write", headers={"X-User-Name": "quiet"}).status_code == 200
+
+
+# Test rotating the X-User-Name header does not get around the per-address limit
+def test_write_rate_limited_rotating_user(limited_client):
+    statuses = [limited_client.post("/write", headers={"X-User-Name": f"user{i}"}).status_code for i in range(6)]
+
+    assert statuses == [200] * 5 + [429]
+
+
+# Test read routes are not rate limited
+def test_reads_not_rate_limited(limited_client):
+    for _ in range(5):
+        assert limited_client.get("/read").status_code == 200
+
+
+# Test the client address is taken from the configured trusted proxy header
+def test_write_rate_limited_behind_proxy():
+    proxied_app = FastAPI()
+    proxied_app.add_middleware(WriteAdmissionMiddleware, address_rate=1.0, address_burst=1,
+                               client_ip_header="X-Forwarded-For")
+
+    @proxied_app.post("/write")
+    def write():
+        return {"ok": True}
+
+    client = TestClient(proxied_app)
+    assert client.post("/write", headers={"X-Forwarded-For": "spoofed, 10.0.0.1"}).status_code == 200
+    assert client.post("/write", headers={"X-Forwarded-For": "10.0.0.1"}).status_code == 429
+    assert client.post("/write", headers={"X-Forwarded-For": "10.0.0.2"}).status_code == 200
+
+
+# Test the per-client pending cap must leave room in the queue for other clients
+def test_write_admission_invalid_pending_cap():
+    with pytest.raises(ValueError, match="max_pending_per_client"):
+        WriteAdmissionMiddleware(None, max_concurrent_writes=1, max_queued_writes=1, max_pending_per_client=2)
+
+
+# Application that holds every request until release is set
+def held_app(release):
+    async def app(scope, receive, send):
+        await release.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    return app
+
+
+# Function to send a POST through the middleware, returning the response status and headers
+async def post(middleware, address):
+    statuses = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            statuses.append((message["status"], dict(message["headers"])))
+
+    scope = {"type": "http", "method": "POST", "path": "/", "headers": [], "client": (address, 1)}
+    await middleware(scope, receive, send)
+    return statuses[0]
+
+
+# Test writes beyond the concurrency cap and queue depth are shed with 503
+def test_write_load_shedding():
+    release = asyncio.Event()
+    middleware = WriteAdmissionMiddleware(held_app(release), rate=100.0, burst=100, max_concurrent_writes=1,
+                                          max_queued_writes=1, max_pending_per_client=1, queue_timeout=5.0)
+
+    async def run():
+        tasks = [asyncio.create_task(post(middleware, f"1.2.3.{i}")) for i in range(3)]
+        await asyncio.sleep(0.01)
+        assert middleware.queued == 1
+        release.set()
+        return await asyncio.gather(*tasks)
+
+    results = asyncio.run(run())
+
+    assert [status for status, _ in results] == [200, 200, 503]
+    assert results[2][1][b"retry-after"] == b"5"
+
+
+# Test a client filling its share of the queue gets 429 while another client still gets through
+def test_write_admission_fair_per_client():
+    release = asyncio.Event()
+    middleware = WriteAdmissionMiddleware(held_app(release), max_concurrent_writes=1, max_queued_writes=4,
+                                          max_pending_per_client=2, queue_timeout=5.0)
+
+    async def run():
+        noisy = [asyncio.create_task(post(middleware, "10.0.0.1")) for _ in range(5)]
+        await asyncio.sleep(0.01)
+        quiet = asyncio.create_task(post(middleware, "10.0.0.2"))
+        await asyncio.sleep(0.01)
+        assert middleware.queued == 2
+        release.set()
+        return await asyncio.gather(*noisy), await quiet
+
+    noisy_results, quiet_result = asyncio.run(run())
+
+    assert sorted(status for status, _ in noisy_results) == [200, 200, 429, 429, 429]
+    assert quiet_result[0] == 200
+    assert middleware._pending == {}